@@ -0,0 +1,176 @@
+"""
+This script compares the verification backends used by
+`synchronise_tweets.py` against a local stand-in for the Twitter API,
+so no credentials or rate limit are needed. For each backend it reports
+the bytes downloaded and the time spent parsing JSON per verified Tweet,
+and checks that both backends agree on which Tweets still exist.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from supporting_files.api_functions import set_up_adapter
+from supporting_files.retry_policy import RetryPolicy
+from supporting_files.verification import BACKENDS
+
+# GLOBALS
+NUM_TWEETS = 5000
+BATCH_SIZE = 100
+FIRST_ID = 1480000000000000000
+
+def is_deleted(tweet_id):
+    return int(tweet_id) % 10 == 0
+
+def is_protected(tweet_id):
+    return int(tweet_id) % 10 == 5
+
+def v1_tweet(tweet_id):
+    """
+    Returns a Tweet as the v1.1 statuses/lookup endpoint
+    would, with the embedded user object.
+    """
+    return {
+        'created_at': 'Mon Jan 10 09:30:00 +0000 2022',
+        'id': int(tweet_id),
+        'id_str': tweet_id,
+        'text': 'Latest figures from @ONS show the economy grew by 0.9% in November https://t.co/abcdefghij',
+        'truncated': False,
+        'entities': {'hashtags': [], 'symbols': [], 'user_mentions': [{'screen_name': 'ONS', 'name': 'Office for National Statistics', 'id': 219275799, 'id_str': '219275799', 'indices': [20, 24]}], 'urls': [{'url': 'https://t.co/abcdefghij', 'expanded_url': 'https://www.ons.gov.uk/economy', 'display_url': 'ons.gov.uk/economy', 'indices': [70, 93]}]},
+        'source': '<a href="https://mobile.twitter.com" rel="nofollow">Twitter Web App</a>',
+        'in_reply_to_status_id': None,
+        'in_reply_to_user_id': None,
+        'user': {
+            'id': 123456789,
+            'id_str': '123456789',
+            'name': 'Example User',
+            'screen_name': 'example_user',
+            'location': 'London, England',
+            'description': 'Interested in economics, statistics and data visualisation. Views my own.',
+            'url': None,
+            'entities': {'description': {'urls': []}},
+            'protected': False,
+            'followers_count': 1234,
+            'friends_count': 567,
+            'listed_count': 12,
+            'created_at': 'Tue Mar 03 12:00:00 +0000 2015',
+            'favourites_count': 8910,
+            'verified': False,
+            'statuses_count': 4321,
+            'lang': None,
+            'profile_background_color': 'C0DEED',
+            'profile_image_url_https': 'https://pbs.twimg.com/profile_images/1234567890/abcdefgh_normal.jpg',
+            'profile_banner_url': 'https://pbs.twimg.com/profile_banners/123456789/1600000000',
+            'default_profile': True,
+            'default_profile_image': False
+        },
+        'geo': None,
+        'coordinates': None,
+        'place': None,
+        'is_quote_status': False,
+        'retweet_count': 3,
+        'favorite_count': 11,
+        'favorited': False,
+        'retweeted': False,
+        'possibly_sensitive': False,
+        'lang': 'en'
+    }
+
+def v2_response(ids):
+    """
+    Returns the response of the v2 tweets?ids= endpoint
+    with only the default fields requested.
+    """
+    data = []
+    errors = []
+    for tweet_id in ids:
+        if is_deleted(tweet_id):
+            errors.append({'value': tweet_id, 'detail': f'Could not find tweet with ids: [{tweet_id}].', 'title': 'Not Found Error', 'resource_type': 'tweet', 'parameter': 'ids', 'resource_id': tweet_id, 'type': 'https://api.twitter.com/2/problems/resource-not-found'})
+        elif is_protected(tweet_id):
+            errors.append({'value': tweet_id, 'detail': f'Sorry, you are not authorized to see the Tweet with ids: [{tweet_id}].', 'title': 'Authorization Error', 'resource_type': 'tweet', 'parameter': 'ids', 'resource_id': tweet_id, 'type': 'https://api.twitter.com/2/problems/not-authorized-for-resource'})
+        else:
+            data.append({'id': tweet_id, 'text': 'Latest figures from @ONS show the economy grew by 0.9% in November https://t.co/abcdefghij', 'edit_history_tweet_ids': [tweet_id]})
+    response = {'data': data}
+    if errors:
+        response['errors'] = errors
+    return response
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Serves the v1.1 statuses/lookup and v2 tweets endpoints
+    """
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/1.1/statuses/lookup.json':
+            ids = query['id'][0].split(',')
+            body = [v1_tweet(tweet_id) for tweet_id in ids if not (is_deleted(tweet_id) or is_protected(tweet_id))]
+        elif url.path == '/2/tweets':
+            body = v2_response(query['ids'][0].split(','))
+        else:
+            self.send_error(404)
+            return
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+def benchmark_backend(name, base_url, list_of_ids):
+    """
+    Verifies every ID in list_of_ids with the named backend
+    and returns the results and measurements.
+    """
+    url = base_url + {'v1': '/1.1/statuses/lookup.json', 'v2': '/2/tweets'}[name]
+    http = set_up_adapter()
+    payloads = []
+    http.hooks['response'].append(lambda r, *args, **kwargs: payloads.append(r.content))
+    policy = RetryPolicy()
+    found, removed, unverified = [], {}, []
+    start = time.perf_counter()
+    for i in range(0, len(list_of_ids), BATCH_SIZE):
+        batch = ','.join(list_of_ids[i:i + BATCH_SIZE])
+        found_batch, removed_batch, unverified_batch = BACKENDS[name](batch, http, policy, url=url, auth=None)
+        found.extend(found_batch)
+        removed.update(removed_batch)
+        unverified.extend(unverified_batch)
+    total_time = time.perf_counter() - start
+    # time JSON parsing on its own, separately from the network round trip
+    start = time.perf_counter()
+    for payload in payloads:
+        json.loads(payload)
+    parse_time = time.perf_counter() - start
+    return {
+        'found': set(found),
+        'removed': removed,
+        'unverified': unverified,
+        'bytes': sum(len(payload) for payload in payloads),
+        'parse_time': parse_time,
+        'total_time': total_time
+    }
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    list_of_ids = [str(FIRST_ID + i) for i in range(NUM_TWEETS)]
+    try:
+        results = {name: benchmark_backend(name, base_url, list_of_ids) for name in BACKENDS}
+    finally:
+        server.shutdown()
+
+    print(f"{NUM_TWEETS} Tweets verified in batches of {BATCH_SIZE}.")
+    print(f"{'backend':<8}{'bytes/Tweet':>12}{'parse us/Tweet':>16}{'total s':>10}{'removed':>9}")
+    for name, result in results.items():
+        print(f"{name:<8}{result['bytes'] / NUM_TWEETS:>12.0f}{result['parse_time'] / NUM_TWEETS * 1e6:>16.2f}{result['total_time']:>10.2f}{len(result['removed']):>9}")
+    assert results['v1']['found'] == results['v2']['found'], "Backends disagree on which Tweets exist."
+    assert set(results['v1']['removed']) == set(results['v2']['removed']), "Backends disagree on which Tweets were removed."
+
+if __name__ == '__main__':
+    main()
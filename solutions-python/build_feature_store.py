@@ -0,0 +1,21 @@
+"""
+This script adds any Tweets in the .tsv file that are missing from
+the NLP feature store (normalised text, tokens and vocabulary IDs).
+`collect_and_anonymise_tweets.py` already does this for new Tweets,
+so it is only needed to backfill Tweets collected before the feature
+store existed. Tweets that are already in the store are not recomputed.
+"""
+
+from supporting_files.feature_store import update_feature_store, feature_store_path
+from supporting_files.tombstones import read_tweets, dataset_lock
+
+# GLOBALS
+TWEET_SAVE_LOCATION = '../data/tweets.tsv'
+
+def main(dataset_path):
+    with dataset_lock(dataset_path):
+        added = update_feature_store(read_tweets(dataset_path), feature_store_path(dataset_path))
+    print(f"Features computed for {added} Tweets.")
+
+if __name__ == '__main__':
+    main(TWEET_SAVE_LOCATION)
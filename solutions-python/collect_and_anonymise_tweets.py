@@ -10,6 +10,10 @@ import os
 import pandas as pd
 import numpy as np
 from supporting_files.api_functions import set_up_adapter, connect_to_endpoint
+from supporting_files.retry_policy import RetryPolicy, TransientAPIError
+from supporting_files.dataset_manifest import update_manifest_on_append
+from supporting_files.feature_store import update_feature_store, feature_store_path
+from supporting_files.tombstones import dataset_lock
 
 def collect_tweets(url, parameters, total_to_collect, verbose):
     """
@@ -44,12 +48,18 @@ def collect_tweets(url, parameters, total_to_collect, verbose):
     tweets = []
     num_requests = 0
     http = set_up_adapter()
+    policy = RetryPolicy()
     if verbose:
         print("Collecting Tweets. This might take a while!")
     # Keep calling the API until we have the desired number of Tweets
     while len(tweets)<total_to_collect:
         # Get a batch of 100 Tweets
-        response = connect_to_endpoint(http, url, parameters)
+        try:
+            response = connect_to_endpoint(http, url, parameters, policy)
+        except TransientAPIError as e:
+            # Retries have been used up - keep what has been collected so far
+            print(f"Twitter API unavailable, stopping with {len(tweets)} Tweets collected: {e}")
+            break
         num_requests += 1
         tweets.extend(response['data'])
         try:
@@ -268,6 +278,11 @@ def check_file_exists(filepath):
 def main(ons_user_id, search_url, query_params, tweet_save_location):
     # Gather Tweets from previous week
     tweets = collect_tweets(search_url, query_params, total_to_collect = 2000, verbose = True)
+
+    # nothing to write, e.g. the API was unavailable from the first request
+    if len(tweets) == 0:
+        print("No Tweets collected, the dataset has not been changed.")
+        return
     
     # convert to dataframe
     tweets_df = create_dataframe(tweets)
@@ -278,11 +293,19 @@ def main(ons_user_id, search_url, query_params, tweet_save_location):
     # tidy the dataframe
     tweets_df = tidy_dataframe(tweets_df)
 
-    # check that the file exists
-    mode, header = check_file_exists(tweet_save_location)
+    # don't write while compact_tweets.py is rewriting the dataset
+    with dataset_lock(tweet_save_location):
+        # check that the file exists
+        mode, header = check_file_exists(tweet_save_location)
+
+        # append to tweets TSV file or create
+        tweets_df.to_csv(tweet_save_location, sep = '\t', index=False, mode=mode, header=header)
+
+        # keep the manifest of row counts and aggregates up to date
+        update_manifest_on_append(tweets_df, tweet_save_location, mode)
 
-    # append to tweets TSV file or create
-    tweets_df.to_csv(tweet_save_location, sep = '\t', index=False, mode=mode, header=header)
+        # tokenise and normalise the new Tweets once, for the NLP analysis
+        update_feature_store(tweets_df, feature_store_path(tweet_save_location))
 
 if __name__ == '__main__':
 
@@ -0,0 +1,36 @@
+"""
+This script folds the tombstone log written by `synchronise_tweets.py`
+into the .tsv file of Tweets, rewriting the file without the removed
+Tweets, and drops them from the NLP feature store. Compacted tombstones
+are moved to an archive file so that an audit trail of removals is kept.
+The dataset is only rewritten once removed Tweets make up more than
+COMPACTION_THRESHOLD (see supporting_files/tombstones.py) of its rows;
+pass threshold=0 to main() to always compact.
+"""
+
+from supporting_files.dataset_manifest import get_manifest, save_manifest
+from supporting_files.feature_store import drop_from_feature_store, feature_store_path
+from supporting_files.tombstones import compact_dataset, tombstone_fraction, load_tombstones, dataset_lock, COMPACTION_THRESHOLD
+
+# GLOBALS
+TWEET_SAVE_LOCATION = '../data/tweets.tsv'
+
+def main(dataset_path, threshold=COMPACTION_THRESHOLD):
+    # stop collect and sync from writing while the dataset is rewritten
+    with dataset_lock(dataset_path):
+        # the manifest only counts Tweets that have not been removed
+        manifest = get_manifest(dataset_path)
+        fraction = tombstone_fraction(manifest['row_count'], dataset_path)
+        if fraction <= threshold:
+            print(f"{fraction:.1%} of rows removed, below the threshold of {threshold:.1%}. Nothing to compact.")
+            return
+        # drop features first - while the tombstones are still logged the
+        # removed Tweets stay hidden if this stops part way
+        drop_from_feature_store(load_tombstones(dataset_path)['id'].tolist(), feature_store_path(dataset_path))
+        removed = compact_dataset(dataset_path)
+        # aggregates are unchanged, but the file sizes need updating
+        save_manifest(manifest, dataset_path)
+    print(f"{removed} removed Tweets compacted out of the dataset.")
+
+if __name__ == '__main__':
+    main(TWEET_SAVE_LOCATION, COMPACTION_THRESHOLD)
@@ -0,0 +1,27 @@
+"""
+This script prints summary statistics of the .tsv file of Tweets
+(row counts, Tweets per day, ID and date ranges, and reply/quote
+rates). The statistics are read from the manifest kept next to
+the dataset, so the dataset itself is only scanned if the manifest
+is missing or out of date.
+"""
+
+from supporting_files.dataset_manifest import get_manifest, dataset_stats
+
+# GLOBALS
+TWEET_SAVE_LOCATION = '../data/tweets.tsv'
+
+def main(dataset_path):
+    stats = dataset_stats(get_manifest(dataset_path))
+    print(f"Total Tweets: {stats['total_tweets']}")
+    print(f"IDs: {stats['id_range'][0]} to {stats['id_range'][1]}")
+    print(f"Created: {stats['created_at_range'][0]} to {stats['created_at_range'][1]}")
+    print(f"Replying to @ONS: {stats['in_reply_to_ons_rate']:.1%}")
+    print(f"Quoting a Tweet: {stats['quoted_rate']:.1%}")
+    print(f"Replying to a Tweet: {stats['replied_rate']:.1%}")
+    print("Tweets per day:")
+    for day, n in stats['tweets_per_day'].items():
+        print(f"\t{day}: {n}")
+
+if __name__ == '__main__':
+    main(TWEET_SAVE_LOCATION)
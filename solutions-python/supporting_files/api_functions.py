@@ -6,7 +6,8 @@ from os import path
 import sys
 
 from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+
+from supporting_files.retry_policy import RetryPolicy
 
 
 path_to_secrets_file = '../../secrets.toml' 
@@ -59,10 +60,10 @@ def bearer_oauth(r):
 
 def set_up_adapter():
     """
-    Creates a requests.Session() object and configures it to
-    apply a retry strategy: 3 total retries on statuses 
-    429, 502, 503, and 504. Time lag between retries increases.
-    Based on https://findwork.dev/blog/advanced-usage-python-requests-timeouts-retries-hooks/
+    Creates a requests.Session() object with a connection pool
+    for the Twitter API. Retries are not done by the session
+    but by RetryPolicy (see supporting_files/retry_policy.py),
+    which can classify errors and honour Retry-After headers.
 
     Returns
     -------
@@ -70,18 +71,13 @@ def set_up_adapter():
                 Has all the methods of the requests package as
                 well as parameters that persist across requests.
     """
-    retry_strategy = Retry(
-        total = 3, # number of retries to attempt
-        status_forcelist=[429, 500, 502, 503, 504], # status codes that will force a retry
-        backoff_factor=1, # determines time lag between retries (increases exponentially)
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
+    adapter = HTTPAdapter(max_retries=0)
     http = requests.Session()
     http.mount("https://", adapter)
     return http
 
 
-def connect_to_endpoint(http, url, params):
+def connect_to_endpoint(http, url, params, policy=None, auth=bearer_oauth):
     """
     This function is what connects us to the Twitter API so that we can request data
 
@@ -97,18 +93,29 @@ def connect_to_endpoint(http, url, params):
     params:     Dict
                 The request parameters in dictionary format
 
+    policy:     RetryPolicy
+                Retry policy to send the request with. Share one
+                across a script run; if None a new one is created.
+
+    auth:       Callable
+                Sets the request's authorization headers
+
     Returns
     ------
     response.json()     json
                         The response from the API in JSON format
+
+    Raises
+    ------
+    PermanentAPIError if the request is invalid (e.g. 400, 401), and
+    TransientAPIError if the API is still unavailable after retrying.
     """
-    response = http.get(
+    if policy is None:
+        policy = RetryPolicy()
+    response = policy.get(
+            http,
             url, 
-            auth=bearer_oauth, 
+            auth=auth, 
             params=params
     )
-    if response.status_code != 200:
-        # TODO wrap this in a retry
-        # TODO error handling - more specific messages for different codes
-        raise Exception(response.status_code, response.text)
-    return response.json()
\ No newline at end of file
+    return response.json()
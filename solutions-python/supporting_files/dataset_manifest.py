@@ -0,0 +1,268 @@
+# DATASET MANIFEST FUNCTIONS
+
+import json
+import os
+
+from supporting_files.tombstones import read_tweets, tombstone_path, compacting_path
+
+
+def manifest_path(dataset_path):
+    """
+    Returns the location of the manifest that sits alongside
+    the given dataset, e.g. '../data/tweets.tsv' is described
+    by '../data/tweets.manifest.json'.
+
+    params
+    ------
+    dataset_path:   str
+                    Location of the .tsv dataset
+    """
+    root, _ = os.path.splitext(dataset_path)
+    return root + '.manifest.json'
+
+
+def empty_manifest():
+    """
+    Returns a manifest describing a dataset with no Tweets.
+    """
+    return {
+        'row_count': 0,
+        'per_day': {},
+        'min_id': None,
+        'max_id': None,
+        'min_created_at': None,
+        'max_created_at': None,
+        'in_reply_to_ons': 0,
+        'quoted': 0,
+        'replied': 0,
+        'data_bytes': 0,
+        'tombstone_bytes': 0
+    }
+
+
+def _pick(a, b, choose, key=None):
+    """
+    Returns choose(a, b), ignoring either value if it is None.
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return choose(a, b, key=key)
+
+
+def summarise_dataframe(df):
+    """
+    Returns a manifest describing the Tweets in the given
+    dataframe. Expects the columns written by
+    tidy_dataframe() in collect_and_anonymise_tweets.py.
+
+    params
+    ------
+    df:         pd.DataFrame
+                A dataframe of tidied Tweets
+    """
+    manifest = empty_manifest()
+    if len(df) == 0:
+        return manifest
+    ids = df['id'].astype(str)
+    created_at = df['created_at'].astype(str)
+    manifest['row_count'] = int(len(df))
+    manifest['per_day'] = {day: int(n) for day, n in created_at.str[:10].value_counts().sort_index().items()}
+    # IDs are compared numerically but stored as strings to avoid float/exponent issues
+    manifest['min_id'] = min(ids, key=int)
+    manifest['max_id'] = max(ids, key=int)
+    # ISO 8601 timestamps sort correctly as strings
+    manifest['min_created_at'] = created_at.min()
+    manifest['max_created_at'] = created_at.max()
+    manifest['in_reply_to_ons'] = int((df['in_reply_to_ons'].astype(str) == 'True').sum())
+    manifest['quoted'] = int(df['quoted_tweet'].notna().sum())
+    manifest['replied'] = int(df['repliedto_tweet'].notna().sum())
+    return manifest
+
+
+def merge_manifests(manifest, addition):
+    """
+    Returns a new manifest describing the rows of both
+    given manifests, as though the Tweets summarised by
+    'addition' had been appended to the dataset.
+
+    params
+    ------
+    manifest:   Dict
+                Manifest of the existing dataset
+    addition:   Dict
+                Manifest of the appended Tweets
+    """
+    merged = empty_manifest()
+    for key in ['row_count', 'in_reply_to_ons', 'quoted', 'replied']:
+        merged[key] = manifest[key] + addition[key]
+    per_day = dict(manifest['per_day'])
+    for day, n in addition['per_day'].items():
+        per_day[day] = per_day.get(day, 0) + n
+    merged['per_day'] = dict(sorted(per_day.items()))
+    merged['min_id'] = _pick(manifest['min_id'], addition['min_id'], min, key=int)
+    merged['max_id'] = _pick(manifest['max_id'], addition['max_id'], max, key=int)
+    merged['min_created_at'] = _pick(manifest['min_created_at'], addition['min_created_at'], min)
+    merged['max_created_at'] = _pick(manifest['max_created_at'], addition['max_created_at'], max)
+    return merged
+
+
+def _tombstone_bytes(dataset_path):
+    """
+    Returns the size of the dataset's tombstone log, including any
+    tombstones part way through compaction, 0 if there is none.
+    """
+    paths = [tombstone_path(dataset_path), compacting_path(dataset_path)]
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def save_manifest(manifest, dataset_path):
+    """
+    Writes the manifest next to the dataset, recording the
+    current size of the dataset file and of its tombstone log
+    so that stale manifests can be detected by load_manifest().
+
+    params
+    ------
+    manifest:       Dict
+                    Manifest to save
+    dataset_path:   str
+                    Location of the .tsv dataset
+    """
+    manifest = dict(manifest)
+    manifest['data_bytes'] = os.path.getsize(dataset_path)
+    manifest['tombstone_bytes'] = _tombstone_bytes(dataset_path)
+    tmp_path = manifest_path(dataset_path) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    # replace in one step so that readers never see a half-written manifest
+    os.replace(tmp_path, manifest_path(dataset_path))
+    return manifest
+
+
+def load_manifest(dataset_path):
+    """
+    Returns the manifest for the given dataset, or None if
+    there is no manifest or it no longer matches the size of
+    the dataset file (e.g. the file was edited by hand) or of
+    the tombstone log (e.g. sync stopped before saving it).
+
+    params
+    ------
+    dataset_path:   str
+                    Location of the .tsv dataset
+    """
+    path = manifest_path(dataset_path)
+    if not (os.path.exists(path) and os.path.exists(dataset_path)):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('data_bytes') != os.path.getsize(dataset_path):
+        return None
+    if manifest.get('tombstone_bytes') != _tombstone_bytes(dataset_path):
+        return None
+    return manifest
+
+
+def rebuild_manifest(dataset_path):
+    """
+    Scans the whole dataset to build and save a fresh manifest.
+    Only needed when the manifest is missing or stale.
+    Tombstoned Tweets are not counted.
+
+    params
+    ------
+    dataset_path:   str
+                    Location of the .tsv dataset
+    """
+    return save_manifest(summarise_dataframe(read_tweets(dataset_path)), dataset_path)
+
+
+def get_manifest(dataset_path):
+    """
+    Returns the manifest for the given dataset, rebuilding
+    it from the data file only if necessary.
+
+    params
+    ------
+    dataset_path:   str
+                    Location of the .tsv dataset
+    """
+    manifest = load_manifest(dataset_path)
+    if manifest is None:
+        manifest = rebuild_manifest(dataset_path)
+    return manifest
+
+
+def update_manifest_on_append(appended_df, dataset_path, mode):
+    """
+    Updates the manifest after appended_df has been written to
+    the dataset. Call this straight after DataFrame.to_csv().
+
+    params
+    ------
+    appended_df:    pd.DataFrame
+                    The Tweets that were just written
+    dataset_path:   str
+                    Location of the .tsv dataset
+    mode:           str
+                    The mode the dataset was written with,
+                    'a' (append) or 'w' (write)
+    """
+    addition = summarise_dataframe(appended_df)
+    if mode == 'w':
+        return save_manifest(addition, dataset_path)
+    existing = load_manifest_before_append(dataset_path, appended_df)
+    if existing is None:
+        # no trustworthy manifest to build on, fall back to a full scan
+        return rebuild_manifest(dataset_path)
+    return save_manifest(merge_manifests(existing, addition), dataset_path)
+
+
+def load_manifest_before_append(dataset_path, appended_df):
+    """
+    Returns the manifest as it was before appended_df was
+    written, or None if it is missing or was already stale.
+    The size check accounts for the bytes just appended.
+
+    params
+    ------
+    dataset_path:   str
+                    Location of the .tsv dataset
+    appended_df:    pd.DataFrame
+                    The Tweets that were just written
+    """
+    path = manifest_path(dataset_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    appended_bytes = len(appended_df.to_csv(sep='\t', index=False, header=False).encode())
+    if manifest.get('data_bytes', 0) + appended_bytes != os.path.getsize(dataset_path):
+        return None
+    if manifest.get('tombstone_bytes') != _tombstone_bytes(dataset_path):
+        return None
+    return manifest
+
+
+def dataset_stats(manifest):
+    """
+    Returns summary statistics of the dataset answered
+    from the manifest alone, without reading the data.
+
+    params
+    ------
+    manifest:   Dict
+                Manifest of the dataset
+    """
+    rows = manifest['row_count']
+    return {
+        'total_tweets': rows,
+        'tweets_per_day': manifest['per_day'],
+        'id_range': (manifest['min_id'], manifest['max_id']),
+        'created_at_range': (manifest['min_created_at'], manifest['max_created_at']),
+        'in_reply_to_ons_rate': manifest['in_reply_to_ons'] / rows if rows else 0.0,
+        'quoted_rate': manifest['quoted'] / rows if rows else 0.0,
+        'replied_rate': manifest['replied'] / rows if rows else 0.0
+    }
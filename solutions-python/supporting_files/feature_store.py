@@ -0,0 +1,463 @@
+# NLP FEATURE STORE FUNCTIONS
+#
+# Normalised text and tokens are computed once per Tweet and saved as
+# raw binary arrays in a directory next to the dataset, sorted by Tweet ID.
+# Each version of the store is a directory (v000001/, v000002/, ...) holding:
+#
+#   ids.bin           int64[n]      Tweet IDs
+#   indptr.bin        int64[n+1]    tokens of Tweet i are token_ids[indptr[i]:indptr[i+1]]
+#   token_ids.bin     int32[nnz]    vocabulary IDs of every token (CSR layout)
+#   text_offsets.bin  int64[n+1]    normalised text of Tweet i is text[text_offsets[i]:text_offsets[i+1]]
+#   text.bin          uint8         UTF-8 normalised text of every Tweet
+#   vocab.txt         str           token of each vocabulary ID, one per line
+#
+# The CURRENT file names the version to read and how many bytes of each
+# file belong to it; anything past that is ignored. New Tweets usually have
+# higher IDs than every stored Tweet, so they are appended to the current
+# version's files in place and CURRENT is then replaced in one step. Only
+# adding Tweets out of ID order or dropping Tweets writes a new version.
+# Scripts that write to the store hold the dataset's lock (see
+# tombstones.dataset_lock()), as appends are not safe to run side by side.
+#
+# Loading memory-maps the arrays, so repeat analyses do not recompute
+# or even fully read the features. Tweets removed by synchronise_tweets.py
+# are hidden on load using the dataset's tombstone log, and only dropped
+# from the arrays when compact_tweets.py compacts the dataset.
+
+import json
+import os
+import re
+import shutil
+import string
+
+import numpy as np
+
+from supporting_files.tombstones import load_tombstones
+
+URL_AND_HANDLE_PATTERN = re.compile(r'(https?://[^"\s]+)|(@\w+)')
+PUNCTUATION_PATTERN = re.compile(f"[{re.escape(string.punctuation)}]")
+WHITESPACE_PATTERN = re.compile(r'\s+')
+ARRAY_DTYPES = {'ids': np.int64, 'indptr': np.int64, 'token_ids': np.int32, 'text_offsets': np.int64, 'text': np.uint8}
+# arrays whose values are offsets into another array, so are shifted when appended to
+OFFSET_ARRAYS = ['indptr', 'text_offsets']
+VOCAB_FILE = 'vocab.txt'
+
+
+def feature_store_path(dataset_path):
+    """
+    Returns the location of the feature store directory that
+    sits alongside the given dataset, e.g. '../data/tweets.tsv'
+    has its features stored in '../data/tweets.features/'.
+
+    params
+    ------
+    dataset_path:   str
+                    Location of the .tsv dataset
+    """
+    root, _ = os.path.splitext(dataset_path)
+    return root + '.features'
+
+
+def normalise_text(text):
+    """
+    Returns the text of a Tweet prepared for topic modelling:
+    lowercased, with hyperlinks, user handles, non-ASCII
+    characters (including emojis) and punctuation removed.
+
+    params
+    ------
+    text:       str
+                The text of a Tweet
+    """
+    text = text.lower()
+    text = URL_AND_HANDLE_PATTERN.sub('', text)
+    text = text.encode('ascii', 'ignore').decode()
+    text = PUNCTUATION_PATTERN.sub('', text)
+    return WHITESPACE_PATTERN.sub(' ', text).strip()
+
+
+def tokenise(normalised_text):
+    """
+    Returns the word tokens of the given normalised text.
+
+    params
+    ------
+    normalised_text:    str
+                        Text returned by normalise_text()
+    """
+    return normalised_text.split()
+
+
+def empty_feature_store():
+    """
+    Returns a feature store holding no Tweets.
+    """
+    return {
+        'ids': np.zeros(0, dtype=np.int64),
+        'indptr': np.zeros(1, dtype=np.int64),
+        'token_ids': np.zeros(0, dtype=np.int32),
+        'text_offsets': np.zeros(1, dtype=np.int64),
+        'text': np.zeros(0, dtype=np.uint8),
+        'vocab': [],
+        'live': np.zeros(0, dtype=bool)
+    }
+
+
+def _version_dir(store_dir, version):
+    return os.path.join(store_dir, f"v{version:06d}")
+
+
+def _read_current(store_dir):
+    """
+    Returns the contents of the feature store's CURRENT file:
+    the version to read and the number of bytes of each of its
+    files that have been committed. Returns None if nothing
+    has been saved.
+
+    params
+    ------
+    store_dir:      str
+                    Location of the feature store directory
+    """
+    current_path = os.path.join(store_dir, 'CURRENT')
+    if not os.path.exists(current_path):
+        return None
+    with open(current_path) as f:
+        return json.load(f)
+
+
+def _write_current(store_dir, current):
+    """
+    Replaces the CURRENT file in one step, so readers only ever
+    see the sizes of files that have been fully written.
+    """
+    current_path = os.path.join(store_dir, 'CURRENT')
+    with open(current_path + '.tmp', 'w') as f:
+        json.dump(current, f)
+    os.replace(current_path + '.tmp', current_path)
+
+
+def current_version(store_dir):
+    """
+    Returns the number of the version of the feature store
+    named in its CURRENT file, or None if nothing has been saved.
+
+    params
+    ------
+    store_dir:      str
+                    Location of the feature store directory
+    """
+    current = _read_current(store_dir)
+    return None if current is None else current['version']
+
+
+def load_feature_store(store_dir, mmap_mode='r', hidden_ids=None):
+    """
+    Returns the current version of the feature store saved in
+    store_dir as a dictionary of arrays, or an empty feature
+    store if nothing has been saved.
+    Arrays are memory-mapped read-only unless mmap_mode is None.
+    store['live'] is False for the rows of hidden_ids.
+
+    params
+    ------
+    store_dir:      str
+                    Location of the feature store directory
+    mmap_mode:      str or None
+                    Passed to np.memmap(), or None to read
+                    the arrays into memory
+    hidden_ids:     List[str] or pd.Series
+                    IDs of Tweets to hide, e.g. tombstoned Tweets
+    """
+    current = _read_current(store_dir)
+    if current is None:
+        return empty_feature_store()
+    version_dir = _version_dir(store_dir, current['version'])
+    store = {}
+    for name, dtype in ARRAY_DTYPES.items():
+        # only read the committed part of each file
+        count = current['sizes'][name + '.bin'] // np.dtype(dtype).itemsize
+        path = os.path.join(version_dir, name + '.bin')
+        if count == 0:
+            # numpy cannot memory-map an empty file
+            store[name] = np.zeros(0, dtype=dtype)
+        elif mmap_mode is None:
+            store[name] = np.fromfile(path, dtype=dtype, count=count)
+        else:
+            store[name] = np.memmap(path, dtype=dtype, mode=mmap_mode, shape=(count,))
+    with open(os.path.join(version_dir, VOCAB_FILE), 'rb') as f:
+        vocab = f.read(current['sizes'][VOCAB_FILE]).decode()
+    # every token ends in a newline, tokens never contain one
+    store['vocab'] = vocab.split('\n')[:-1]
+    hidden_ids = [] if hidden_ids is None else hidden_ids
+    store['live'] = ~np.isin(store['ids'], np.asarray(hidden_ids, dtype=np.int64))
+    return store
+
+
+def load_features(dataset_path, mmap_mode='r'):
+    """
+    Returns the feature store of the given dataset with the
+    Tweets in its tombstone log hidden. This is how analyses
+    should load the features.
+
+    params
+    ------
+    dataset_path:   str
+                    Location of the .tsv dataset
+    mmap_mode:      str or None
+                    Passed to load_feature_store()
+    """
+    return load_feature_store(feature_store_path(dataset_path), mmap_mode, load_tombstones(dataset_path)['id'])
+
+
+def _vocab_bytes(tokens):
+    return ''.join(token + '\n' for token in tokens).encode()
+
+
+def save_feature_store(store, store_dir):
+    """
+    Writes the given feature store to store_dir as a new version.
+    The files are written to their own directory and the CURRENT
+    file is then switched to it in one step, so readers (and a
+    crash part way through) only ever see a complete version.
+    The previous version is kept for readers that are still
+    loading it; older versions are deleted.
+
+    params
+    ------
+    store:          Dict
+                    Feature store of arrays and vocabulary
+    store_dir:      str
+                    Location of the feature store directory
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    previous = current_version(store_dir)
+    version = 1 if previous is None else previous + 1
+    version_dir = _version_dir(store_dir, version)
+    tmp_dir = version_dir + '.tmp'
+    # clear out anything left by a save that crashed
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    shutil.rmtree(version_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    sizes = {}
+    for name, dtype in ARRAY_DTYPES.items():
+        data = np.asarray(store[name], dtype=dtype).tobytes()
+        with open(os.path.join(tmp_dir, name + '.bin'), 'wb') as f:
+            f.write(data)
+        sizes[name + '.bin'] = len(data)
+    data = _vocab_bytes(store['vocab'])
+    with open(os.path.join(tmp_dir, VOCAB_FILE), 'wb') as f:
+        f.write(data)
+    sizes[VOCAB_FILE] = len(data)
+    os.rename(tmp_dir, version_dir)
+    _write_current(store_dir, {'version': version, 'sizes': sizes})
+
+    for entry in os.listdir(store_dir):
+        if re.fullmatch(r'v\d{6}', entry) and int(entry[1:]) not in (version, previous):
+            shutil.rmtree(os.path.join(store_dir, entry), ignore_errors=True)
+
+
+def _append_bytes(path, committed_size, data):
+    """
+    Writes data to the file at path straight after its first
+    committed_size bytes, and returns the file's new size.
+    """
+    with open(path, 'r+b') as f:
+        f.truncate(committed_size)
+        f.seek(committed_size)
+        f.write(data)
+    return committed_size + len(data)
+
+
+def _append_to_feature_store(store, addition, store_dir):
+    """
+    Appends the rows of addition to the end of the current
+    version's files in place, then commits them by replacing
+    the CURRENT file. Readers of the store keep seeing the rows
+    that were committed when they loaded it, and anything a
+    crashed append left past the committed sizes is cut off
+    before appending again. Every ID in addition must be higher
+    than every ID in the store.
+
+    params
+    ------
+    store:          Dict
+                    Feature store returned by load_feature_store()
+    addition:       Dict
+                    Feature store of the new Tweets, sorted by ID, whose
+                    vocab extends the vocab of store
+    store_dir:      str
+                    Location of the feature store directory
+    """
+    current = _read_current(store_dir)
+    version_dir = _version_dir(store_dir, current['version'])
+    appended = {name: addition[name] for name in ARRAY_DTYPES}
+    for name in OFFSET_ARRAYS:
+        # offsets of the new rows continue on from the last stored row
+        appended[name] = addition[name][1:] + store[name][-1]
+    sizes = dict(current['sizes'])
+    for name, dtype in ARRAY_DTYPES.items():
+        data = np.asarray(appended[name], dtype=dtype).tobytes()
+        sizes[name + '.bin'] = _append_bytes(os.path.join(version_dir, name + '.bin'), sizes[name + '.bin'], data)
+    data = _vocab_bytes(addition['vocab'][len(store['vocab']):])
+    sizes[VOCAB_FILE] = _append_bytes(os.path.join(version_dir, VOCAB_FILE), sizes[VOCAB_FILE], data)
+    _write_current(store_dir, {'version': current['version'], 'sizes': sizes})
+
+
+def compute_features(tweets_df, vocab):
+    """
+    Normalises and tokenises the text of every Tweet in tweets_df,
+    adding unseen tokens to the end of vocab. Returns a feature
+    store of the new Tweets in the same layout as the saved one.
+
+    params
+    ------
+    tweets_df:  pd.DataFrame
+                A dataframe of Tweets with 'id' and 'text' columns
+    vocab:      List[str]
+                Existing vocabulary, extended in place
+    """
+    token_lookup = {token: i for i, token in enumerate(vocab)}
+    indptr = [0]
+    token_ids = []
+    texts = []
+    for text in tweets_df['text'].fillna('').astype(str):
+        normalised = normalise_text(text)
+        for token in tokenise(normalised):
+            if token not in token_lookup:
+                token_lookup[token] = len(vocab)
+                vocab.append(token)
+            token_ids.append(token_lookup[token])
+        indptr.append(len(token_ids))
+        texts.append(normalised.encode())
+    text_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in texts], out=text_offsets[1:])
+    return {
+        'ids': tweets_df['id'].astype(np.int64).to_numpy(),
+        'indptr': np.array(indptr, dtype=np.int64),
+        'token_ids': np.array(token_ids, dtype=np.int32),
+        'text_offsets': text_offsets,
+        'text': np.frombuffer(b''.join(texts), dtype=np.uint8),
+        'vocab': vocab
+    }
+
+
+def _take_rows(store, rows):
+    """
+    Returns the arrays of store restricted to the given row
+    indices, in the given order.
+    """
+    def take_ragged(indptr, values):
+        starts = np.asarray(indptr[:-1])[rows]
+        lengths = np.asarray(indptr[1:])[rows] - starts
+        new_indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=new_indptr[1:])
+        # index of every value to keep, built without a Python loop
+        positions = np.repeat(starts - new_indptr[:-1], lengths) + np.arange(new_indptr[-1])
+        return new_indptr, np.asarray(values)[positions]
+
+    indptr, token_ids = take_ragged(store['indptr'], store['token_ids'])
+    text_offsets, text = take_ragged(store['text_offsets'], store['text'])
+    return {
+        'ids': np.asarray(store['ids'])[rows],
+        'indptr': indptr,
+        'token_ids': token_ids,
+        'text_offsets': text_offsets,
+        'text': text,
+        'vocab': store['vocab']
+    }
+
+
+def _concatenate(store, addition):
+    """
+    Returns the rows of store followed by the rows of addition.
+    """
+    return {
+        'ids': np.concatenate([store['ids'], addition['ids']]),
+        'indptr': np.concatenate([store['indptr'], addition['indptr'][1:] + store['indptr'][-1]]),
+        'token_ids': np.concatenate([store['token_ids'], addition['token_ids']]),
+        'text_offsets': np.concatenate([store['text_offsets'], addition['text_offsets'][1:] + store['text_offsets'][-1]]),
+        'text': np.concatenate([store['text'], addition['text']]),
+        'vocab': addition['vocab']
+    }
+
+
+def update_feature_store(tweets_df, store_dir):
+    """
+    Computes features for the Tweets in tweets_df that are not
+    already in the feature store and saves them. Tweets that
+    have already been processed are not recomputed, and if every
+    new Tweet has a higher ID than the stored ones (as newly
+    collected Tweets do) they are appended without rewriting
+    the store. Returns the number of Tweets added.
+
+    params
+    ------
+    tweets_df:  pd.DataFrame
+                A dataframe of Tweets with 'id' and 'text' columns
+    store_dir:  str
+                Location of the feature store directory
+    """
+    store = load_feature_store(store_dir)
+    ids = tweets_df['id'].astype(np.int64).to_numpy()
+    # the stored IDs are sorted, so binary search them rather than reading them all
+    rows = np.searchsorted(store['ids'], ids)
+    stored = rows < len(store['ids'])
+    stored[stored] = store['ids'][rows[stored]] == ids[stored]
+    new_rows = ~stored
+    # keep the first occurrence of any ID repeated within tweets_df
+    new_rows &= ~tweets_df['id'].astype(np.int64).duplicated().to_numpy()
+    if not new_rows.any():
+        return 0
+    addition = compute_features(tweets_df[new_rows], list(store['vocab']))
+    # keep the store sorted by ID so that lookups can binary search
+    addition = _take_rows(addition, np.argsort(addition['ids'], kind='stable'))
+    if len(store['ids']) > 0 and addition['ids'][0] > store['ids'][-1]:
+        _append_to_feature_store(store, addition, store_dir)
+    else:
+        combined = _concatenate(store, addition)
+        save_feature_store(_take_rows(combined, np.argsort(combined['ids'], kind='stable')), store_dir)
+    return int(new_rows.sum())
+
+
+def drop_from_feature_store(tweet_ids, store_dir):
+    """
+    Removes the features of the given Tweets from the feature
+    store, e.g. when compact_tweets.py removes them from the
+    dataset. Vocabulary IDs are left unchanged.
+    Returns the number of Tweets dropped.
+
+    params
+    ------
+    tweet_ids:  List[str]
+                IDs of the Tweets to drop
+    store_dir:  str
+                Location of the feature store directory
+    """
+    store = load_feature_store(store_dir, mmap_mode=None)
+    drop = np.isin(store['ids'], np.array(tweet_ids, dtype=np.int64))
+    if not drop.any():
+        return 0
+    save_feature_store(_take_rows(store, np.flatnonzero(~drop)), store_dir)
+    return int(drop.sum())
+
+
+def get_features(store, tweet_id):
+    """
+    Returns the normalised text and tokens of the given Tweet,
+    or None if it is not in the feature store or is hidden.
+
+    params
+    ------
+    store:      Dict
+                Feature store returned by load_feature_store()
+    tweet_id:   str or int
+                ID of the Tweet
+    """
+    tweet_id = int(tweet_id)
+    row = int(np.searchsorted(store['ids'], tweet_id))
+    if row == len(store['ids']) or store['ids'][row] != tweet_id or not store['live'][row]:
+        return None
+    text = bytes(store['text'][store['text_offsets'][row]:store['text_offsets'][row + 1]]).decode()
+    tokens = [store['vocab'][i] for i in store['token_ids'][store['indptr'][row]:store['indptr'][row + 1]]]
+    return text, tokens
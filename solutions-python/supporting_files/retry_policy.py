@@ -0,0 +1,319 @@
+# RETRY POLICY FOR TWITTER API REQUESTS
+#
+# Failed requests are classified as transient (worth retrying: rate
+# limits, server errors, dropped connections) or permanent (bad request,
+# bad credentials). Transient failures are retried with decorrelated
+# jitter backoff, honouring any Retry-After the API sends. A circuit
+# breaker per endpoint stops hammering an endpoint that keeps failing,
+# and a retry budget caps retries at a fraction of all requests so a bad
+# outage cannot burn the whole rate limit.
+
+import random
+import time
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class TwitterAPIError(Exception):
+    """
+    Raised when the Twitter API does not return a usable response.
+    args are (status_code, text) as for the bare Exception this replaces;
+    status_code is None if no response was received.
+    """
+    def __init__(self, status_code, text):
+        super().__init__(status_code, text)
+        self.status_code = status_code
+        self.text = text
+
+
+class TransientAPIError(TwitterAPIError):
+    """
+    A failure that may succeed if tried again later,
+    e.g. 429 Too Many Requests, a 5xx status or a timeout.
+    """
+
+
+class PermanentAPIError(TwitterAPIError):
+    """
+    A failure that will not succeed if retried,
+    e.g. 400 Bad Request or 401 Unauthorized.
+    """
+
+
+class CircuitOpenError(TransientAPIError):
+    """
+    Raised without sending a request because the
+    endpoint's circuit breaker is open. retry_in is the
+    number of seconds until a request will be let through.
+    """
+    def __init__(self, text, retry_in):
+        super().__init__(None, text)
+        self.retry_in = retry_in
+
+
+class RetryBudgetExhaustedError(TransientAPIError):
+    """
+    Raised instead of retrying because too large a share
+    of recent requests have already been retries.
+    """
+
+
+def classify_response(response):
+    """
+    Returns None if the response was successful, otherwise
+    the TransientAPIError or PermanentAPIError describing it.
+
+    params
+    ------
+    response:   requests.Response
+                Response from the Twitter API
+    """
+    if response.status_code == 200:
+        return None
+    if response.status_code in TRANSIENT_STATUS_CODES:
+        return TransientAPIError(response.status_code, response.text)
+    return PermanentAPIError(response.status_code, response.text)
+
+
+def parse_retry_after(response, now=None):
+    """
+    Returns how many seconds the API has asked us to wait
+    before retrying, or None if it did not say. Reads the
+    standard Retry-After header (seconds or an HTTP date)
+    and falls back to Twitter's x-rate-limit-reset header
+    (epoch seconds) on 429 responses.
+
+    params
+    ------
+    response:   requests.Response or None
+                Response from the Twitter API
+    now:        float
+                Current epoch time, defaults to time.time()
+    """
+    if response is None:
+        return None
+    now = time.time() if now is None else now
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is not None:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, retry_at.timestamp() - now)
+    reset = response.headers.get('x-rate-limit-reset')
+    if response.status_code == 429 and reset is not None:
+        try:
+            return max(0.0, float(reset) - now)
+        except ValueError:
+            return None
+    return None
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive failed requests to one endpoint. A
+    request counts as failed once RetryPolicy has given up
+    retrying it, so one request's retries cannot open the
+    circuit on their own. After failure_threshold failed
+    requests in a row the circuit opens and requests are
+    refused for reset_timeout seconds.
+    After that a single trial request is let through: if it
+    succeeds the circuit closes, otherwise it opens again.
+
+    params
+    ------
+    failure_threshold:  int
+                        Consecutive failed requests that open the circuit
+    reset_timeout:      float
+                        Seconds to refuse requests once open
+    clock:              Callable[[], float]
+                        Returns the current time in seconds
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=60, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        """
+        Returns True if a request may be sent.
+        """
+        if self.opened_at is None:
+            return True
+        # half open - allow one trial request, and re-arm the timeout
+        # so that further requests wait for the trial's outcome
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            self.opened_at = self.clock()
+            return True
+        return False
+
+    def seconds_until_retry(self):
+        """
+        Returns how long until allow() will let a request through.
+        """
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (self.clock() - self.opened_at))
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+
+
+class RetryBudget:
+    """
+    Limits retries to min_retries plus a fraction (ratio)
+    of all requests sent, so retries cannot dominate the
+    traffic sent to the API during an outage.
+
+    params
+    ------
+    ratio:          float
+                    Retries allowed per request sent
+    min_retries:    int
+                    Retries allowed regardless of traffic
+    """
+    def __init__(self, ratio=0.2, min_retries=10):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.requests = 0
+        self.retries = 0
+
+    def record_request(self):
+        self.requests += 1
+
+    def withdraw(self):
+        """
+        Returns True and counts a retry if the budget allows
+        one, otherwise returns False.
+        """
+        if self.retries >= self.min_retries + self.ratio * self.requests:
+            return False
+        self.retries += 1
+        return True
+
+
+class RetryPolicy:
+    """
+    Sends GET requests to the Twitter API, retrying transient
+    failures. Create one per script run and share it between
+    requests, so that circuit breakers and the retry budget
+    see all of the run's traffic.
+
+    params
+    ------
+    max_retries:        int
+                        Retries per request after the first attempt
+    base_delay:         float
+                        Smallest backoff between retries, in seconds
+    max_delay:          float
+                        Largest backoff between retries, in seconds
+    max_retry_after:    float
+                        Longest Retry-After to wait for; longer waits
+                        raise the TransientAPIError instead
+    timeout:            float
+                        Seconds to wait for the API to respond
+    budget:             RetryBudget
+                        Shared limit on retries
+    breaker_factory:    Callable[[], CircuitBreaker]
+                        Creates the circuit breaker for each endpoint
+    sleep:              Callable[[float], None]
+                        Used to wait between retries
+    rng:                random.Random
+                        Source of backoff jitter
+    """
+    def __init__(self, max_retries=5, base_delay=1, max_delay=60, max_retry_after=15*60, timeout=30,
+                 budget=None, breaker_factory=CircuitBreaker, sleep=time.sleep, rng=None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.timeout = timeout
+        self.budget = RetryBudget() if budget is None else budget
+        self.breaker_factory = breaker_factory
+        self.breakers = {}
+        self.sleep = sleep
+        self.rng = random.Random() if rng is None else rng
+
+    def breaker_for(self, url):
+        """
+        Returns the circuit breaker of the endpoint at url,
+        ignoring any query string.
+        """
+        parts = urlsplit(url)
+        endpoint = f"{parts.scheme}://{parts.netloc}{parts.path}"
+        if endpoint not in self.breakers:
+            self.breakers[endpoint] = self.breaker_factory()
+        return self.breakers[endpoint]
+
+    def next_delay(self, previous_delay):
+        """
+        Returns the next backoff using "decorrelated jitter":
+        a random delay between base_delay and three times the
+        previous delay, capped at max_delay.
+        """
+        return min(self.max_delay, self.rng.uniform(self.base_delay, previous_delay * 3))
+
+    def get(self, http, url, **kwargs):
+        """
+        Sends a GET request to url, retrying transient failures,
+        and returns the successful requests.Response.
+        Raises PermanentAPIError straight away, and
+        TransientAPIError (or a subclass) once it gives up.
+
+        params
+        ------
+        http:       requests.Session object
+                    Session to send the request with
+        url:        str
+                    The endpoint to connect to
+        kwargs:     Passed to http.get(), e.g. params and auth
+        """
+        breaker = self.breaker_for(url)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {url}, not sending request.", breaker.seconds_until_retry())
+        delay = self.base_delay
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = http.get(url, timeout=self.timeout, **kwargs)
+                error = classify_response(response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = TransientAPIError(None, str(e))
+            self.budget.record_request()
+            if error is None or isinstance(error, PermanentAPIError):
+                # the endpoint answered, so it is healthy
+                breaker.record_success()
+                if error is None:
+                    return response
+                raise error
+            attempt += 1
+            retry_after = parse_retry_after(response)
+            if attempt > self.max_retries or (retry_after is not None and retry_after > self.max_retry_after):
+                # only a request that has been given up on counts against the endpoint
+                breaker.record_failure()
+                raise error
+            if not self.budget.withdraw():
+                breaker.record_failure()
+                raise RetryBudgetExhaustedError(error.status_code, error.text) from error
+            delay = self.next_delay(delay)
+            self.sleep(delay if retry_after is None else retry_after)
@@ -0,0 +1,266 @@
+# TOMBSTONE LOG FUNCTIONS
+#
+# Tweets removed from the dataset are not deleted from the .tsv straight
+# away. Instead their IDs are appended to a tombstone log next to the
+# dataset, and readers drop them on load. compact_tweets.py folds the
+# tombstones into the dataset once they make up too much of it.
+#
+# Scripts that write to the dataset or its tombstone log hold the
+# dataset's lock file (see dataset_lock()) while they do so, so that
+# compaction never overwrites rows or tombstones written alongside it.
+
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+
+# Read the ID columns as strings - as floats, long Tweet IDs lose precision
+TWEET_DTYPES = {'id': str, 'repliedto_tweet': str, 'quoted_tweet': str}
+TOMBSTONE_COLUMNS = ['id', 'removed_at', 'reason']
+# Fraction of the dataset's rows that can be tombstoned before it should be compacted
+COMPACTION_THRESHOLD = 0.1
+
+
+def tombstone_path(dataset_path):
+    """
+    Returns the location of the tombstone log that sits alongside
+    the given dataset, e.g. '../data/tweets.tsv' has its removals
+    logged in '../data/tweets.tombstones.tsv'.
+
+    params
+    ------
+    dataset_path:   str
+                    Location of the .tsv dataset
+    """
+    root, _ = os.path.splitext(dataset_path)
+    return root + '.tombstones.tsv'
+
+
+def compacting_path(dataset_path):
+    """
+    Returns the location that compact_dataset() moves the tombstone
+    log to while it applies it, so that tombstones appended during
+    compaction go to a fresh log and are not lost.
+
+    params
+    ------
+    dataset_path:   str
+                    Location of the .tsv dataset
+    """
+    root, _ = os.path.splitext(dataset_path)
+    return root + '.tombstones.compacting.tsv'
+
+
+def lock_path(dataset_path):
+    """
+    Returns the location of the dataset's lock file.
+
+    params
+    ------
+    dataset_path:   str
+                    Location of the .tsv dataset
+    """
+    root, _ = os.path.splitext(dataset_path)
+    return root + '.lock'
+
+
+@contextmanager
+def dataset_lock(dataset_path, timeout=600, poll_interval=1):
+    """
+    Holds the dataset's lock file for the duration of a with block.
+    Waits up to timeout seconds for another script to release it,
+    then raises TimeoutError.
+
+    params
+    ------
+    dataset_path:   str
+                    Location of the .tsv dataset
+    timeout:        float
+                    Seconds to wait for the lock
+    poll_interval:  float
+                    Seconds between attempts to take the lock
+    """
+    path = lock_path(dataset_path)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            # O_EXCL makes creating the file fail if it already exists
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"{path} is held by another script. If none is running, delete the file and try again.")
+            time.sleep(poll_interval)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        os.remove(path)
+
+
+def archive_path(dataset_path):
+    """
+    Returns the location of the archive that compacted
+    tombstones are moved to, keeping an audit trail of removals.
+
+    params
+    ------
+    dataset_path:   str
+                    Location of the .tsv dataset
+    """
+    root, _ = os.path.splitext(dataset_path)
+    return root + '.tombstones.archive.tsv'
+
+
+def _append_tsv(df, filepath):
+    """
+    Appends df to the .tsv at filepath, writing headers
+    only if the file does not exist yet.
+    """
+    exists = os.path.exists(filepath)
+    df.to_csv(filepath, sep='\t', index=False, mode='a' if exists else 'w', header=not exists)
+
+
+def append_tombstones(tweet_ids, dataset_path, reason='not_found'):
+    """
+    Records the given Tweet IDs as removed from the dataset.
+    The cost is proportional to the number of IDs, not the
+    size of the dataset.
+
+    params
+    ------
+    tweet_ids:      List[str]
+                    IDs of the Tweets to remove
+    dataset_path:   str
+                    Location of the .tsv dataset
+    reason:         str or List[str]
+                    Why each Tweet was removed
+    """
+    if len(tweet_ids) == 0:
+        return
+    tombstones = pd.DataFrame(
+        data = {
+            'id': [str(tweet_id) for tweet_id in tweet_ids],
+            'removed_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'reason': reason
+        }
+    )
+    _append_tsv(tombstones[TOMBSTONE_COLUMNS], tombstone_path(dataset_path))
+
+
+def load_tombstones(dataset_path):
+    """
+    Returns the tombstone log of the given dataset as a
+    dataframe (empty if nothing has been removed), including
+    any tombstones that are part way through compaction.
+
+    params
+    ------
+    dataset_path:   str
+                    Location of the .tsv dataset
+    """
+    paths = [path for path in [compacting_path(dataset_path), tombstone_path(dataset_path)] if os.path.exists(path)]
+    if len(paths) == 0:
+        return pd.DataFrame(columns=TOMBSTONE_COLUMNS, dtype=str)
+    return pd.concat([pd.read_csv(path, sep='\t', dtype=str) for path in paths], ignore_index=True)
+
+
+def apply_tombstones(tweets_df, tombstone_ids):
+    """
+    Returns tweets_df without the rows whose ID is in
+    tombstone_ids. This is a hash-based anti-join, so it
+    runs in time linear in the number of rows.
+
+    params
+    ------
+    tweets_df:      pd.DataFrame
+                    A dataframe of Tweets with string IDs
+    tombstone_ids:  List[str] or pd.Series
+                    IDs of removed Tweets
+    """
+    if len(tombstone_ids) == 0:
+        return tweets_df
+    return tweets_df[~tweets_df['id'].isin(pd.unique(pd.Series(tombstone_ids, dtype=str)))]
+
+
+def read_raw_tweets(dataset_path):
+    """
+    Returns every row of the dataset, including Tweets
+    that have been tombstoned but not yet compacted.
+
+    params
+    ------
+    dataset_path:   str
+                    Location of the .tsv dataset
+    """
+    return pd.read_csv(dataset_path, sep='\t', dtype=TWEET_DTYPES)
+
+
+def read_tweets(dataset_path):
+    """
+    Returns the Tweets in the dataset that have not been removed.
+    This is how all scripts should load the dataset.
+
+    params
+    ------
+    dataset_path:   str
+                    Location of the .tsv dataset
+    """
+    return apply_tombstones(read_raw_tweets(dataset_path), load_tombstones(dataset_path)['id'])
+
+
+def tombstone_fraction(live_row_count, dataset_path):
+    """
+    Returns the fraction of rows in the dataset file that
+    are tombstoned. Every tombstone refers to a row that is
+    still in the file, so the file holds live + tombstoned rows.
+
+    params
+    ------
+    live_row_count: int
+                    Number of Tweets that have not been
+                    removed, e.g. from the dataset manifest
+    dataset_path:   str
+                    Location of the .tsv dataset
+    """
+    pending = load_tombstones(dataset_path)['id'].nunique()
+    total = live_row_count + pending
+    return pending / total if total else 0.0
+
+
+def compact_dataset(dataset_path):
+    """
+    Rewrites the dataset without its tombstoned Tweets, then
+    moves the tombstones to the archive so that the log only
+    holds removals that have not been compacted yet.
+    Returns the number of rows dropped from the dataset.
+    Call this while holding dataset_lock().
+
+    The log is first moved aside in one step, so tombstones
+    appended while compacting start a new log rather than being
+    deleted unapplied. A log left aside by a compaction that
+    crashed is picked up again.
+
+    params
+    ------
+    dataset_path:   str
+                    Location of the .tsv dataset
+    """
+    compacting = compacting_path(dataset_path)
+    if not os.path.exists(compacting):
+        if not os.path.exists(tombstone_path(dataset_path)):
+            return 0
+        os.replace(tombstone_path(dataset_path), compacting)
+    tombstones = pd.read_csv(compacting, sep='\t', dtype=str)
+    raw = read_raw_tweets(dataset_path)
+    compacted = apply_tombstones(raw, tombstones['id'])
+    tmp_path = dataset_path + '.tmp'
+    compacted.to_csv(tmp_path, sep='\t', index=False)
+    # replace in one step so that a failed write never loses the dataset
+    os.replace(tmp_path, dataset_path)
+    _append_tsv(tombstones, archive_path(dataset_path))
+    os.remove(compacting)
+    return len(raw) - len(compacted)
@@ -0,0 +1,91 @@
+# TWEET VERIFICATION BACKENDS
+#
+# Each backend looks up one batch of up to 100 Tweet IDs and reports
+# which still exist. They share the signature
+#
+#   lookup(ids, http, policy, url, auth) -> (found, removed, unverified)
+#
+# found:        List[str]       IDs of Tweets that still exist
+# removed:      Dict[str, str]  ID -> reason, for Tweets that should be removed
+# unverified:   List[str]       IDs whose status could not be determined
+#
+# so synchronise_tweets.py can use either interchangeably.
+
+from supporting_files.api_functions import connect_to_endpoint, bearer_oauth
+
+V1_LOOKUP_URL = 'https://api.twitter.com/1.1/statuses/lookup.json'
+V2_LOOKUP_URL = 'https://api.twitter.com/2/tweets'
+
+# v2 problem types that tell us a Tweet is gone for good
+V2_REMOVAL_REASONS = {
+    'https://api.twitter.com/2/problems/resource-not-found': 'deleted',
+    'https://api.twitter.com/2/problems/not-authorized-for-resource': 'protected'
+}
+
+
+def lookup_v1(ids, http, policy, url=V1_LOOKUP_URL, auth=bearer_oauth):
+    """
+    Looks up Tweets with the v1.1 statuses/lookup endpoint, which
+    returns full Tweet and user objects for the Tweets that can be
+    seen and silently leaves out the rest. Any Tweet not returned
+    is reported as removed with reason 'not_found'.
+
+    params
+    ------
+    ids:        str
+                Comma-separated Tweet IDs, as returned by
+                get_next_n() in synchronise_tweets.py
+    http:       requests.Session object
+                Session to send the request with
+    policy:     RetryPolicy
+                Retry policy shared by the whole run
+    url:        str
+                The endpoint to connect to
+    auth:       Callable
+                Sets the request's authorization headers
+    """
+    response = connect_to_endpoint(http, url, {'id': ids}, policy, auth=auth)
+    found = [str(tweet['id']) for tweet in response if 'id' in tweet]
+    removed = {tweet_id: 'not_found' for tweet_id in set(ids.split(',')).difference(found)}
+    return found, removed, []
+
+
+def lookup_v2(ids, http, policy, url=V2_LOOKUP_URL, auth=bearer_oauth):
+    """
+    Looks up Tweets with the v2 batch tweets?ids= endpoint. No
+    expansions or extra fields are requested, so only the default
+    Tweet fields come back and no user objects. Tweets listed in
+    the 'errors' array are classified as deleted or protected;
+    any other error, or an ID missing from both 'data' and
+    'errors', leaves that Tweet unverified.
+
+    params
+    ------
+    ids:        str
+                Comma-separated Tweet IDs, as returned by
+                get_next_n() in synchronise_tweets.py
+    http:       requests.Session object
+                Session to send the request with
+    policy:     RetryPolicy
+                Retry policy shared by the whole run
+    url:        str
+                The endpoint to connect to
+    auth:       Callable
+                Sets the request's authorization headers
+    """
+    response = connect_to_endpoint(http, url, {'ids': ids}, policy, auth=auth)
+    found = [tweet['id'] for tweet in response.get('data', [])]
+    removed = {}
+    for error in response.get('errors', []):
+        tweet_id = error.get('resource_id', error.get('value'))
+        reason = V2_REMOVAL_REASONS.get(error.get('type'))
+        if tweet_id is not None and reason is not None:
+            removed[tweet_id] = reason
+    unverified = list(set(ids.split(',')).difference(found, removed))
+    return found, removed, unverified
+
+
+BACKENDS = {
+    'v1': lookup_v1,
+    'v2': lookup_v2
+}
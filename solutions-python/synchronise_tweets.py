@@ -2,18 +2,25 @@
 This script iterates through all of the Tweets in a .tsv file
 and calls the Twitter API to check that each Tweet still exists
 on Twitter. Any Tweets that no longer exist on Twitter are 
-removed from the .tsv file.
+recorded in a tombstone log next to the .tsv file, so that they
+are dropped whenever the dataset is read. The .tsv file itself is
+only rewritten by `compact_tweets.py`.
 """
 
-import pandas as pd
 import time
 
-from supporting_files.api_functions import set_up_adapter, bearer_oauth
+from supporting_files.api_functions import set_up_adapter
+from supporting_files.dataset_manifest import rebuild_manifest
+from supporting_files.retry_policy import RetryPolicy, TransientAPIError, CircuitOpenError
+from supporting_files.tombstones import read_tweets, append_tombstones, tombstone_fraction, dataset_lock, COMPACTION_THRESHOLD
+from supporting_files.verification import BACKENDS
 
 # GLOBALS
-SEARCH_URL = 'https://api.twitter.com/1.1/statuses/lookup.json'
+VERIFICATION_BACKEND = 'v2'  # 'v1' for the statuses/lookup endpoint, see supporting_files/verification.py
 TWEET_SAVE_LOCATION = '../data/tweets.tsv'
-NEW_SAVE_LOCATION = '../data/tweets_synchronised.tsv'  # in prod this should be = TWEET_SAVE_LOCATION (overwrite)
+MINIMUM_DATASET_SIZE = 3600
+TARGET_DATASET_SIZE = 4500
+MAX_CIRCUIT_WAITS = 3  # times to wait for an open circuit breaker before skipping a batch
 
 def format_list_of_ids(list_of_ids):
     """
@@ -50,52 +57,71 @@ def get_next_n(list_of_ids, bookmark, n = 100):
     next_n_tweets = format_list_of_ids(next_n_tweets)
     return next_n_tweets, next_bookmark
 
-def get_batch(list_of_ids, http):
-    """
-    Returns the given list of IDs as a single string
-    of comma-separated IDs.
-    
-    params
-    ------
-    list_of_ids:    List[int]
-                    List of Tweet IDs
-
-    http:           requests.Session object
-                    Has all the methods of the requests 
-                    package as well as parameters that 
-                    persist across requests.
-
-    """
-    url = SEARCH_URL + '?id=' + list_of_ids
-    response = http.get(
-            url, 
-            auth=bearer_oauth
-        )
-    return response.json()
-
-def fetch_all_tweets(list_of_ids):
+def fetch_all_tweets(list_of_ids, lookup=None, http=None, policy=None):
     """
     Given the list of Tweet IDs, repeatedly call the
-    Twitter API to fetch the metadata of the Tweets
-    in batches of 100. Returns a list of IDs that were
-    returned without error (i.e. the Tweets still exist)
+    Twitter API to look up the Tweets in batches of 100.
+    Returns the IDs of Tweets that still exist, a
+    dictionary of removed Tweet IDs and the reason for
+    each removal, and a list of IDs that could not be
+    checked because the API was unavailable. Unchecked
+    IDs must not be treated as deleted.
 
     params
     ------
-    list_of_ids:    List[int]
+    list_of_ids:    List[str]
                     A list of Tweet IDs to search for 
+    lookup:         Callable
+                    Verification backend from
+                    supporting_files/verification.py,
+                    defaults to VERIFICATION_BACKEND
+    http:           requests.Session object
+                    Session to send requests with,
+                    defaults to set_up_adapter()
+    policy:         RetryPolicy
+                    Retry policy for the whole run,
+                    defaults to RetryPolicy()
     """
+    if lookup is None:
+        lookup = BACKENDS[VERIFICATION_BACKEND]
+    if http is None:
+        http = set_up_adapter()
+    if policy is None:
+        policy = RetryPolicy()
     bookmark = 0
     tweets = []
-    http = set_up_adapter()
+    removed = {}
+    unverified = []
     while bookmark is not None:
         ids, bookmark = get_next_n(list_of_ids, bookmark)
-        response = get_batch(ids, http)
-        # Just store the IDs of the found Tweets
-        tweets.extend([str(r['id']) for r in response if 'id' in r.keys()])
+        if ids == '':
+            break
+        batch = None
+        for circuit_waits in range(MAX_CIRCUIT_WAITS + 1):
+            try:
+                batch = lookup(ids, http, policy)
+                break
+            except CircuitOpenError as e:
+                if circuit_waits == MAX_CIRCUIT_WAITS:
+                    print(f"Could not check batch of Tweets: {e}")
+                    break
+                # the API has been failing - wait for it rather than writing off the rest of the run
+                print(f"Twitter API unavailable, retrying batch in {e.retry_in:.0f} seconds.")
+                policy.sleep(e.retry_in)
+            except TransientAPIError as e:
+                print(f"Could not check batch of Tweets: {e}")
+                break
+        if batch is None:
+            # an error page is not "zero Tweets found", so keep these IDs
+            unverified.extend(ids.split(','))
+            continue
+        found_batch, removed_batch, unverified_batch = batch
+        tweets.extend(found_batch)
+        removed.update(removed_batch)
+        unverified.extend(unverified_batch)
         time.sleep(1)
-    print(f"{len(list_of_ids)} Tweets searched for, {len(tweets)} Tweets returned.")
-    return tweets
+    print(f"{len(list_of_ids)} Tweets searched for, {len(tweets)} Tweets returned, {len(unverified)} Tweets could not be checked.")
+    return tweets, removed, unverified
 
 def identify_missing_tweets(list_of_ids, found_ids):
     """
@@ -113,38 +139,64 @@ def identify_missing_tweets(list_of_ids, found_ids):
     """
     return list(set(list_of_ids).difference(set(found_ids)))
 
-def filter_out_missing_tweets(tweets_df):
+def find_missing_tweets(tweets_df, lookup=None, http=None, policy=None):
     """
-    Takes a dataframe and fetches list of Tweet IDs
-    that are present in the dataframe but NOT on 
-    the Twitter API. Returns the dataframe filtered to
-    remove these IDs.
+    Takes a dataframe and returns a dictionary of the
+    Tweet IDs that are present in the dataframe but NOT
+    on the Twitter API, and why each one is missing
+    (e.g. 'deleted' or 'protected').
     
     params
     ------
-    list_of_ids:    List[int]
-                    List of Tweet IDs
+    tweets_df:      pd.DataFrame
+                    A dataframe of Tweets with string IDs
+    lookup, http, policy:
+                    Passed to fetch_all_tweets()
     """
     tweet_ids = tweets_df['id'].tolist()
-    missing_tweet_ids = identify_missing_tweets(tweet_ids, fetch_all_tweets(tweet_ids))
-    print(f"{len(missing_tweet_ids)} Tweets removed.")
-    return tweets_df[~tweets_df['id'].isin(missing_tweet_ids)]
+    found_ids, removed, unverified_ids = fetch_all_tweets(tweet_ids, lookup, http, policy)
+    # Tweets that could not be checked are kept
+    missing_tweet_ids = identify_missing_tweets(tweet_ids, found_ids + unverified_ids)
+    return {tweet_id: removed.get(tweet_id, 'not_found') for tweet_id in missing_tweet_ids}
 
-def main():
-    # load tweets
-    stored_tweets = pd.read_csv(TWEET_SAVE_LOCATION, sep = '\t')
-    stored_tweets['id'] = stored_tweets['id'].astype(str)
+def check_dataset_size(manifest):
+    """
+    Warns the user if the dataset described by the manifest
+    has dropped below MINIMUM_DATASET_SIZE Tweets, and tells
+    them how many Tweets to collect to replenish it.
 
-    # identify and remove deleted tweets
-    synchronised_tweets = filter_out_missing_tweets(stored_tweets)
+    params
+    ------
+    manifest:   Dict
+                Manifest of the dataset, see
+                supporting_files/dataset_manifest.py
+    """
+    total = manifest['row_count']
+    if total <= MINIMUM_DATASET_SIZE:
+        print(f"Warning. Total number of Tweets has dropped by > 20%. Current size of dataset: {total}.")
+        print(f"Please run script `collect_and_anonymise_tweets.py` to replenish. Set `total_to_collect` to {TARGET_DATASET_SIZE - total}.")
 
-    # save
-    synchronised_tweets.to_csv(NEW_SAVE_LOCATION, sep = '\t', index = False)
+def main():
+    # load tweets, skipping any that have already been removed
+    stored_tweets = read_tweets(TWEET_SAVE_LOCATION)
+
+    # identify deleted tweets and record them in the tombstone log
+    missing_tweets = find_missing_tweets(stored_tweets)
+    missing_tweet_ids = list(missing_tweets)
+    # don't write while compact_tweets.py is rewriting the dataset
+    with dataset_lock(TWEET_SAVE_LOCATION):
+        append_tombstones(missing_tweet_ids, TWEET_SAVE_LOCATION, reason=list(missing_tweets.values()))
+        # the data file and feature store are untouched, so only the manifest needs saving.
+        # Tweets may have been collected during the sync, so summarise the dataset as it is now
+        manifest = rebuild_manifest(TWEET_SAVE_LOCATION)
+    print(f"{len(missing_tweet_ids)} Tweets removed.")
 
     # Warn user if number of Tweets is too low
-    if len(synchronised_tweets) <= 3600:
-        print(f"Warning. Total number of Tweets has dropped by > 20%. Current size of dataset: {len(synchronised_tweets)}.")
-        print(f"Please run script `collect_and_anonymise_tweets.py` to replenish. Set `total_to_collect` to {4500 - len(synchronised_tweets)}.")
+    check_dataset_size(manifest)
+
+    # Suggest compaction once removed Tweets make up too much of the file
+    if tombstone_fraction(manifest['row_count'], TWEET_SAVE_LOCATION) > COMPACTION_THRESHOLD:
+        print(f"Over {COMPACTION_THRESHOLD:.0%} of the rows in the dataset have been removed. Run script `compact_tweets.py` to compact it.")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -171,6 +171,18 @@ def test_sort_referenced_tweets_repliedto(input_list, expected_output):
     """
     pass
 
+def test_nothing_collected_leaves_dataset_alone(tmp_path, monkeypatch, capsys):
+    """
+    Check that main() stops with a message, rather than failing to
+    build a dataframe, when no Tweets could be collected.
+    """
+    import collect_and_anonymise_tweets
+    monkeypatch.setattr(collect_and_anonymise_tweets, 'collect_tweets', lambda *args, **kwargs: [])
+    dataset = tmp_path / 'tweets.tsv'
+    collect_and_anonymise_tweets.main('219275799', 'https://api.twitter.com/2/tweets/search/recent', {}, str(dataset))
+    assert "No Tweets collected" in capsys.readouterr().out
+    assert list(tmp_path.iterdir()) == []
+
 """----------------------------------------------------------------
 
         Functions from synchronise_tweets.py
@@ -206,3 +218,486 @@ def test_identify_missing_tweets():
     IDs that are present in the first list but not the second.
     """
     pass
+
+
+"""----------------------------------------------------------------
+
+        Functions from supporting_files/dataset_manifest.py
+
+----------------------------------------------------------------"""
+
+from supporting_files.dataset_manifest import summarise_dataframe, update_manifest_on_append, load_manifest, rebuild_manifest, dataset_stats
+
+def make_tidy_df(ids, created_at):
+    """
+    Returns a small dataframe with the columns written by tidy_dataframe()
+    """
+    n = len(ids)
+    return pd.DataFrame(
+        data = {
+            'id': ids,
+            'created_at': created_at,
+            'in_reply_to_ons': [i % 2 == 0 for i in range(n)],
+            'repliedto_tweet': ['111' if i % 2 == 0 else np.nan for i in range(n)],
+            'quoted_tweet': ['222' if i == 0 else np.nan for i in range(n)],
+            'text': [f"tweet {i}" for i in range(n)]
+        }
+    )
+
+def test_summarise_dataframe():
+    """
+    Check that the manifest built from a dataframe holds the expected aggregates.
+    IDs of different lengths should be compared numerically, not as strings.
+    """
+    df = make_tidy_df(['99', '1000', '500'], ['2022-01-02T10:00:00.000Z', '2022-01-01T09:00:00.000Z', '2022-01-02T11:00:00.000Z'])
+    manifest = summarise_dataframe(df)
+    assert manifest['row_count'] == 3
+    assert manifest['per_day'] == {'2022-01-01': 1, '2022-01-02': 2}
+    assert (manifest['min_id'], manifest['max_id']) == ('99', '1000')
+    assert manifest['min_created_at'] == '2022-01-01T09:00:00.000Z'
+    assert (manifest['in_reply_to_ons'], manifest['replied'], manifest['quoted']) == (2, 2, 1)
+
+def test_manifest_appends_match_rebuild(tmp_path):
+    """
+    Check that a manifest maintained across a write and an append
+    matches one rebuilt from a full scan of the dataset.
+    """
+    dataset = str(tmp_path / 'tweets.tsv')
+    first = make_tidy_df(['1', '2'], ['2022-01-01T00:00:00.000Z', '2022-01-01T01:00:00.000Z'])
+    second = make_tidy_df(['3', '4', '5'], ['2022-01-02T00:00:00.000Z', '2022-01-01T02:00:00.000Z', '2022-01-03T00:00:00.000Z'])
+    first.to_csv(dataset, sep = '\t', index = False, mode = 'w', header = True)
+    update_manifest_on_append(first, dataset, 'w')
+    second.to_csv(dataset, sep = '\t', index = False, mode = 'a', header = False)
+    incremental = update_manifest_on_append(second, dataset, 'a')
+    assert load_manifest(dataset) == incremental
+    assert rebuild_manifest(dataset) == incremental
+    assert dataset_stats(incremental)['total_tweets'] == 5
+
+def test_stale_manifest_is_ignored(tmp_path):
+    """
+    Check that a manifest is not trusted once the dataset has changed underneath it.
+    """
+    dataset = str(tmp_path / 'tweets.tsv')
+    df = make_tidy_df(['1'], ['2022-01-01T00:00:00.000Z'])
+    df.to_csv(dataset, sep = '\t', index = False)
+    update_manifest_on_append(df, dataset, 'w')
+    with open(dataset, 'a') as f:
+        f.write("2\t2022-01-01T00:00:00.000Z\tFalse\t\t\thand edited\n")
+    assert load_manifest(dataset) is None
+
+
+"""----------------------------------------------------------------
+
+        Functions from supporting_files/tombstones.py
+
+----------------------------------------------------------------"""
+
+import os
+from supporting_files.tombstones import append_tombstones, apply_tombstones, read_tweets, compact_dataset, tombstone_fraction, tombstone_path, archive_path, compacting_path, dataset_lock
+
+def test_apply_tombstones():
+    """
+    Check that tombstoned IDs are dropped and all other rows are kept in order.
+    """
+    df = make_tidy_df(['1', '2', '3', '4'], ['2022-01-01T00:00:00.000Z'] * 4)
+    assert apply_tombstones(df, ['3', '1', '3', '99'])['id'].tolist() == ['2', '4']
+    assert apply_tombstones(df, []).equals(df)
+
+def test_tombstones_and_compaction(tmp_path):
+    """
+    Check that tombstoned Tweets are hidden from readers without touching the
+    dataset, and that compaction removes them from the file and archives the log.
+    """
+    dataset = str(tmp_path / 'tweets.tsv')
+    df = make_tidy_df(['1481000000000000001', '2', '3', '4'], ['2022-01-01T00:00:00.000Z'] * 4)
+    df.to_csv(dataset, sep = '\t', index = False)
+    size_before = os.path.getsize(dataset)
+
+    append_tombstones(['2'], dataset)
+    append_tombstones(['4'], dataset, reason = 'protected')
+    assert os.path.getsize(dataset) == size_before
+    assert read_tweets(dataset)['id'].tolist() == ['1481000000000000001', '3']
+    assert tombstone_fraction(2, dataset) == 0.5
+
+    assert compact_dataset(dataset) == 2
+    assert not os.path.exists(tombstone_path(dataset))
+    assert pd.read_csv(archive_path(dataset), sep = '\t', dtype = str)['reason'].tolist() == ['not_found', 'protected']
+    assert read_tweets(dataset)['id'].tolist() == ['1481000000000000001', '3']
+    assert tombstone_fraction(2, dataset) == 0.0
+
+def test_compaction_keeps_tombstones_written_meanwhile(tmp_path):
+    """
+    Check that tombstones moved aside for compaction still hide their Tweets,
+    that tombstones appended after the move go to a new log instead of being
+    lost, and that a compaction that stopped part way is finished next time.
+    """
+    dataset = str(tmp_path / 'tweets.tsv')
+    make_tidy_df(['1', '2', '3'], ['2022-01-01T00:00:00.000Z'] * 3).to_csv(dataset, sep = '\t', index = False)
+    append_tombstones(['1'], dataset)
+    # as left by a compaction that stopped after moving the log aside
+    os.replace(tombstone_path(dataset), compacting_path(dataset))
+    append_tombstones(['2'], dataset)
+    assert read_tweets(dataset)['id'].tolist() == ['3']
+
+    assert compact_dataset(dataset) == 1
+    assert not os.path.exists(compacting_path(dataset))
+    assert pd.read_csv(archive_path(dataset), sep = '\t', dtype = str)['id'].tolist() == ['1']
+    assert read_tweets(dataset)['id'].tolist() == ['3']
+    assert compact_dataset(dataset) == 1
+    assert pd.read_csv(dataset, sep = '\t', dtype = str)['id'].tolist() == ['3']
+
+def test_dataset_lock_is_exclusive(tmp_path):
+    """
+    Check that a second script cannot take the dataset lock while it is held,
+    and can once it is released.
+    """
+    dataset = str(tmp_path / 'tweets.tsv')
+    with dataset_lock(dataset):
+        with pytest.raises(TimeoutError):
+            with dataset_lock(dataset, timeout = 0):
+                pass
+    with dataset_lock(dataset, timeout = 0):
+        pass
+
+def test_manifest_is_stale_after_unsaved_tombstones(tmp_path):
+    """
+    Check that tombstones written without saving the manifest (e.g. sync
+    stopped part way) make the manifest stale, and the rebuild leaves them out.
+    """
+    dataset = str(tmp_path / 'tweets.tsv')
+    df = make_tidy_df(['1', '2', '3'], ['2022-01-01T00:00:00.000Z'] * 3)
+    df.to_csv(dataset, sep = '\t', index = False)
+    update_manifest_on_append(df, dataset, 'w')
+    append_tombstones(['2'], dataset)
+    assert load_manifest(dataset) is None
+    assert rebuild_manifest(dataset)['row_count'] == 2
+    assert load_manifest(dataset)['row_count'] == 2
+
+
+"""----------------------------------------------------------------
+
+        Functions from supporting_files/feature_store.py
+
+----------------------------------------------------------------"""
+
+from supporting_files.feature_store import normalise_text, update_feature_store, drop_from_feature_store, load_feature_store, get_features, current_version, load_features, feature_store_path
+
+normalise_text_test_cases = [
+    ('Hello @ONS, see https://t.co/abc123!', 'hello see'),
+    ('GDP   up 0.5%\nthis #quarter', 'gdp up 05 this quarter'),
+    ('Great stats 👍 from @user', 'great stats from')
+]
+
+@pytest.mark.parametrize("input_text, expected_output", normalise_text_test_cases)
+def test_normalise_text(input_text, expected_output):
+    """
+    Check that text is lowercased and stripped of links, handles, emojis and punctuation.
+    """
+    assert normalise_text(input_text) == expected_output
+
+def test_feature_store_updates_and_drops(tmp_path):
+    """
+    Check that the feature store only computes features for new Tweets,
+    stays sorted by ID, and drops Tweets removed by synchronisation.
+    """
+    store_dir = str(tmp_path / 'tweets.features')
+    first = pd.DataFrame({'id': ['30', '10'], 'text': ['Census results out', 'census day']})
+    second = pd.DataFrame({'id': ['10', '20'], 'text': ['ignored, already stored', 'Inflation #data']})
+    assert update_feature_store(first, store_dir) == 2
+    assert update_feature_store(second, store_dir) == 1
+
+    store = load_feature_store(store_dir)
+    assert isinstance(store['token_ids'], np.memmap)
+    assert store['ids'].tolist() == [10, 20, 30]
+    assert get_features(store, '10') == ('census day', ['census', 'day'])
+    assert get_features(store, '30') == ('census results out', ['census', 'results', 'out'])
+    assert get_features(store, '99') is None
+
+    assert drop_from_feature_store(['20', '99'], store_dir) == 1
+    store = load_feature_store(store_dir)
+    assert store['ids'].tolist() == [10, 30]
+    assert get_features(store, '30') == ('census results out', ['census', 'results', 'out'])
+    assert store['vocab'][:2] == ['census', 'results']
+
+
+def test_feature_store_versions_are_switched_atomically(tmp_path):
+    """
+    Check that a save interrupted part way leaves readers on the last
+    complete version, and that only the current and previous versions are kept.
+    """
+    store_dir = str(tmp_path / 'tweets.features')
+    # IDs lower than the stored ones cannot be appended, so each save writes a new version
+    update_feature_store(pd.DataFrame({'id': ['3'], 'text': ['three']}), store_dir)
+    update_feature_store(pd.DataFrame({'id': ['2'], 'text': ['two']}), store_dir)
+    # a crashed save leaves a partial directory that is never named in CURRENT
+    os.makedirs(os.path.join(store_dir, 'v000003.tmp'))
+    np.array([99]).tofile(os.path.join(store_dir, 'v000003.tmp', 'ids.bin'))
+    assert current_version(store_dir) == 2
+    assert load_feature_store(store_dir)['ids'].tolist() == [2, 3]
+
+    update_feature_store(pd.DataFrame({'id': ['1'], 'text': ['one']}), store_dir)
+    assert load_feature_store(store_dir)['ids'].tolist() == [1, 2, 3]
+    assert sorted(os.listdir(store_dir)) == ['CURRENT', 'v000002', 'v000003']
+
+def test_feature_store_appends_newer_tweets_in_place(tmp_path):
+    """
+    Check that Tweets with higher IDs than the stored ones are appended to the
+    current version, without disturbing readers of the store or being
+    corrupted by an append that crashed part way.
+    """
+    store_dir = str(tmp_path / 'tweets.features')
+    update_feature_store(pd.DataFrame({'id': ['1'], 'text': ['census day']}), store_dir)
+    reader = load_feature_store(store_dir)
+    update_feature_store(pd.DataFrame({'id': ['2'], 'text': ['census results']}), store_dir)
+    assert current_version(store_dir) == 1
+    assert sorted(os.listdir(store_dir)) == ['CURRENT', 'v000001']
+    assert reader['ids'].tolist() == [1]
+    assert get_features(load_feature_store(store_dir), '2') == ('census results', ['census', 'results'])
+
+    # a crashed append leaves bytes past the committed sizes, which are ignored
+    for name in ['ids.bin', 'vocab.txt']:
+        with open(os.path.join(store_dir, 'v000001', name), 'ab') as f:
+            f.write(b'partial!')
+    assert load_feature_store(store_dir)['vocab'] == ['census', 'day', 'results']
+    update_feature_store(pd.DataFrame({'id': ['4', '3'], 'text': ['four', 'day three']}), store_dir)
+    store = load_feature_store(store_dir)
+    assert store['ids'].tolist() == [1, 2, 3, 4]
+    assert store['vocab'] == ['census', 'day', 'results', 'four', 'three']
+    assert get_features(store, '3') == ('day three', ['day', 'three'])
+    assert get_features(store, '4') == ('four', ['four'])
+
+def test_tombstoned_features_are_hidden(tmp_path):
+    """
+    Check that Tweets in the tombstone log are hidden from the feature
+    store on load without the store being rewritten.
+    """
+    dataset = str(tmp_path / 'tweets.tsv')
+    store_dir = feature_store_path(dataset)
+    update_feature_store(pd.DataFrame({'id': ['1', '2'], 'text': ['one', 'two']}), store_dir)
+    append_tombstones(['2'], dataset)
+    store = load_features(dataset)
+    assert current_version(store_dir) == 1
+    assert store['live'].tolist() == [True, False]
+    assert get_features(store, '1') == ('one', ['one'])
+    assert get_features(store, '2') is None
+
+def test_compaction_drops_features(tmp_path):
+    """
+    Check that compact_tweets.py removes tombstoned Tweets from the feature store.
+    """
+    import compact_tweets
+    dataset = str(tmp_path / 'tweets.tsv')
+    df = make_tidy_df(['1', '2'], ['2022-01-01T00:00:00.000Z'] * 2)
+    df.to_csv(dataset, sep = '\t', index = False)
+    update_feature_store(df, feature_store_path(dataset))
+    append_tombstones(['2'], dataset)
+    compact_tweets.main(dataset, threshold = 0)
+    assert load_feature_store(feature_store_path(dataset))['ids'].tolist() == [1]
+
+"""----------------------------------------------------------------
+
+        Functions from supporting_files/retry_policy.py
+
+----------------------------------------------------------------"""
+
+import random
+import requests
+from supporting_files.retry_policy import RetryPolicy, RetryBudget, CircuitBreaker, TransientAPIError, PermanentAPIError, CircuitOpenError, RetryBudgetExhaustedError, parse_retry_after
+
+class FakeResponse:
+    """
+    Stands in for a requests.Response
+    """
+    def __init__(self, status_code, headers=None, text='', payload=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = text
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+class FakeSession:
+    """
+    Stands in for a requests.Session, returning (or raising) the given outcomes in turn
+    """
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+def make_policy(sleeps, **kwargs):
+    return RetryPolicy(sleep=sleeps.append, rng=random.Random(0), **kwargs)
+
+def test_retry_after_is_honoured():
+    """
+    Check that a 429 is retried after the wait given in Retry-After,
+    and that dropped connections are retried with jittered backoff.
+    """
+    sleeps = []
+    http = FakeSession([FakeResponse(429, {'Retry-After': '7'}), requests.ConnectionError('reset'), FakeResponse(200)])
+    assert make_policy(sleeps).get(http, 'https://api.twitter.com/2/tweets').status_code == 200
+    assert sleeps[0] == 7
+    assert 1 <= sleeps[1] <= 60
+
+def test_parse_retry_after():
+    """
+    Check Retry-After in seconds, Twitter's rate limit reset header, and no header.
+    """
+    assert parse_retry_after(FakeResponse(503, {'Retry-After': '120'})) == 120
+    assert parse_retry_after(FakeResponse(429, {'x-rate-limit-reset': '1030'}), now = 1000) == 30
+    assert parse_retry_after(FakeResponse(503)) is None
+
+def test_permanent_errors_are_not_retried():
+    """
+    Check that a 401 is raised straight away without retrying.
+    """
+    sleeps = []
+    http = FakeSession([FakeResponse(401, text = 'Unauthorized')])
+    with pytest.raises(PermanentAPIError) as e:
+        make_policy(sleeps).get(http, 'https://api.twitter.com/2/tweets')
+    assert e.value.status_code == 401
+    assert http.calls == 1 and sleeps == []
+
+def test_circuit_breaker_opens():
+    """
+    Check that one request's retries cannot open the circuit on their own,
+    but that after repeated failed requests further requests to the endpoint
+    fail fast without being sent, while other endpoints are unaffected.
+    """
+    sleeps = []
+    policy = make_policy(sleeps, max_retries = 3, breaker_factory = lambda: CircuitBreaker(failure_threshold = 2, reset_timeout = 60))
+    http = FakeSession([FakeResponse(503)] * 8 + [FakeResponse(200)])
+    url = 'https://api.twitter.com/1.1/statuses/lookup.json'
+    with pytest.raises(TransientAPIError):
+        policy.get(http, url + '?id=1')
+    assert http.calls == 4
+    with pytest.raises(TransientAPIError):
+        policy.get(http, url + '?id=2')
+    assert http.calls == 8
+    with pytest.raises(CircuitOpenError) as e:
+        policy.get(http, url + '?id=3')
+    assert http.calls == 8
+    assert 0 < e.value.retry_in <= 60
+    assert policy.get(http, 'https://api.twitter.com/2/tweets').status_code == 200
+
+def test_retry_budget_is_shared():
+    """
+    Check that retries stop once the shared retry budget is used up.
+    """
+    sleeps = []
+    policy = make_policy(sleeps, budget = RetryBudget(ratio = 0, min_retries = 1))
+    http = FakeSession([FakeResponse(500), FakeResponse(500), FakeResponse(500)])
+    with pytest.raises(RetryBudgetExhaustedError):
+        policy.get(http, 'https://api.twitter.com/2/tweets')
+    assert http.calls == 2 and len(sleeps) == 1
+
+
+"""----------------------------------------------------------------
+
+        Functions from supporting_files/verification.py
+
+----------------------------------------------------------------"""
+
+from supporting_files.verification import lookup_v1, lookup_v2
+
+def test_lookup_v2_classifies_errors():
+    """
+    Check that the v2 backend reads deleted and protected Tweets from the
+    'errors' array, and leaves Tweets with other errors unverified.
+    """
+    payload = {
+        'data': [{'id': '1', 'text': 'hello'}],
+        'errors': [
+            {'resource_id': '2', 'type': 'https://api.twitter.com/2/problems/resource-not-found'},
+            {'resource_id': '3', 'type': 'https://api.twitter.com/2/problems/not-authorized-for-resource'},
+            {'resource_id': '4', 'type': 'https://api.twitter.com/2/problems/resource-unavailable'}
+        ]
+    }
+    http = FakeSession([FakeResponse(200, payload = payload)])
+    found, removed, unverified = lookup_v2('1,2,3,4,5', http, make_policy([]), auth = None)
+    assert found == ['1']
+    assert removed == {'2': 'deleted', '3': 'protected'}
+    assert sorted(unverified) == ['4', '5']
+
+def test_lookup_v1_matches_v2():
+    """
+    Check that given the same Tweet IDs, the v1 and v2 backends report the
+    same Tweets as found and removed, so that the two are interchangeable.
+    Tweet 2 has been deleted and Tweet 3 made protected.
+    """
+    ids = '1,2,3'
+    v1_http = FakeSession([FakeResponse(200, payload = [{'id': 1, 'id_str': '1'}])])
+    v2_http = FakeSession([FakeResponse(200, payload = {
+        'data': [{'id': '1', 'text': 'hi'}],
+        'errors': [
+            {'resource_id': '2', 'type': 'https://api.twitter.com/2/problems/resource-not-found'},
+            {'resource_id': '3', 'type': 'https://api.twitter.com/2/problems/not-authorized-for-resource'}
+        ]
+    })])
+    v1_found, v1_removed, v1_unverified = lookup_v1(ids, v1_http, make_policy([]), auth = None)
+    v2_found, v2_removed, v2_unverified = lookup_v2(ids, v2_http, make_policy([]), auth = None)
+    assert v1_found == v2_found == ['1']
+    # v1 cannot tell why a Tweet is missing, so only compare which Tweets were removed
+    assert set(v1_removed) == set(v2_removed) == {'2', '3'}
+    assert v1_unverified == v2_unverified == []
+
+
+"""----------------------------------------------------------------
+
+        Verification in synchronise_tweets.py
+
+----------------------------------------------------------------"""
+
+import synchronise_tweets
+from synchronise_tweets import find_missing_tweets, fetch_all_tweets
+
+def v2_payload(ids, deleted = ()):
+    """
+    Returns a v2 tweets?ids= response in which the given IDs were deleted
+    """
+    return {
+        'data': [{'id': i, 'text': 'hi'} for i in ids if i not in deleted],
+        'errors': [{'resource_id': i, 'type': 'https://api.twitter.com/2/problems/resource-not-found'} for i in deleted]
+    }
+
+def test_error_page_does_not_delete_tweets(monkeypatch):
+    """
+    Check that when one batch only gets error pages back, its Tweets are kept
+    rather than treated as deleted, and the other batches are still checked.
+    """
+    monkeypatch.setattr(synchronise_tweets.time, 'sleep', lambda seconds: None)
+    ids = [str(1000 + i) for i in range(250)]
+    http = FakeSession([
+        FakeResponse(200, payload = v2_payload(ids[:100], deleted = ['1005'])),
+        FakeResponse(503, text = '<html>Over capacity</html>'),
+        FakeResponse(503, text = '<html>Over capacity</html>'),
+        FakeResponse(200, payload = v2_payload(ids[200:], deleted = ['1210']))
+    ])
+    tweets_df = pd.DataFrame({'id': ids})
+    missing = find_missing_tweets(tweets_df, lookup = lookup_v2, http = http, policy = make_policy([], max_retries = 1))
+    assert missing == {'1005': 'deleted', '1210': 'deleted'}
+    assert http.calls == 4
+
+def test_open_circuit_waits_and_retries_batch(monkeypatch):
+    """
+    Check that a batch refused by an open circuit breaker is retried after
+    the breaker's timeout, rather than being skipped.
+    """
+    monkeypatch.setattr(synchronise_tweets.time, 'sleep', lambda seconds: None)
+    outcomes = [CircuitOpenError('open', retry_in = 42), (['1', '2'], {}, [])]
+    def lookup(ids, http, policy):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    sleeps = []
+    found, removed, unverified = fetch_all_tweets(['1', '2'], lookup = lookup, http = object(), policy = make_policy(sleeps))
+    assert sleeps == [42]
+    assert (found, removed, unverified) == (['1', '2'], {}, [])